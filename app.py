@@ -1,18 +1,46 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash, session, abort
-import base64
+from flask import Flask, Request, render_template, stream_template, request, redirect, url_for, send_file, send_from_directory, flash, session, abort, make_response, g
+import atexit
+import gzip
+import hashlib
+import importlib.util
 import os
+import re
 import json
+import threading
+import time
+import weakref
 import uuid
-from datetime import datetime, timedelta
-from functools import wraps
+import zlib
+from datetime import date, timedelta
+from functools import lru_cache, wraps
+from tempfile import SpooledTemporaryFile
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from contextlib import contextmanager
-from werkzeug.utils import secure_filename
+from types import MappingProxyType
+from typing import NamedTuple
+from flask.json.provider import DefaultJSONProvider
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+# Imported on first use by the ToS page; only probe for it here
+MARKDOWN_AVAILABLE = importlib.util.find_spec("markdown") is not None
+
+try:
+    from pybase64 import b64decode, b64encode  # SIMD-accelerated, same API as the stdlib
+except ImportError:
+    from base64 import b64decode, b64encode
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
 
 try:
-    import markdown
-    MARKDOWN_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    MARKDOWN_AVAILABLE = False
+    ORJSON_AVAILABLE = False
 
 try:
     import psycopg2
@@ -23,21 +51,136 @@ except ImportError:  # pragma: no cover - psycopg2 is required in prod
     extras = None
 
 import bcrypt
-import boto3
-from botocore.exceptions import BotoCoreError, ClientError
+
+
+class OrJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider (responses and session cookie) backed by orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+class UploadRequest(Request):
+    """Request that keeps uploads up to MAX_CONTENT_LENGTH in memory instead of spilling to disk."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledTemporaryFile(max_size=app.config['MAX_CONTENT_LENGTH'], mode="rb+")
+
 
 app = Flask(__name__)
+app.request_class = UploadRequest
+if ORJSON_AVAILABLE:
+    app.json = OrJSONProvider(app)
+    if extras:
+        # Decode plan_data (jsonb) with orjson too; writes already go through dump_json
+        extras.register_default_jsonb(globally=True, loads=orjson.loads)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB max file size
 
 # Allowed file extensions for diagrams
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg'}
+DIAGRAM_MIME_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'svg': 'image/svg+xml',
+}
+
+# Diagrams in one submission are stored concurrently (S3 round trips dominate)
+DIAGRAM_UPLOAD_WORKERS = int(os.environ.get('DIAGRAM_UPLOAD_WORKERS', '8'))
+_upload_pool = ThreadPoolExecutor(max_workers=DIAGRAM_UPLOAD_WORKERS)
+
+# Read size for base64 fallback encoding; a multiple of 3 so only the last chunk is padded
+BASE64_CHUNK_SIZE = 57 * 1024
+
+def source_build_id() -> str:
+    """Hash of app.py and the templates, so every worker of one deployment agrees on it"""
+    digest = hashlib.blake2b(digest_size=16)
+    root = os.path.dirname(os.path.abspath(__file__))
+    template_dir = os.path.join(root, "templates")
+    paths = [os.path.join(root, "app.py")] + sorted(
+        os.path.join(dirpath, name)
+        for dirpath, _, names in os.walk(template_dir)
+        for name in names
+    )
+    for path in paths:
+        digest.update(os.path.relpath(path, root).encode("utf-8"))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+# Identifies the deployed code, so cached pages are invalidated by a new deployment
+BUILD_ID = os.environ.get("BUILD_ID") or os.environ.get("VERCEL_GIT_COMMIT_SHA") or source_build_id()
+
+# Scalar lesson plan form fields; each has a matching "_zh" field for the Chinese template
+_LESSON_BASE_FIELDS = (
+    "teacher_name", "pesh_year", "date", "class_duration", "start_time", "end_time",
+    "school_name", "year", "class_id", "class_level", "class_size", "boys", "girls",
+    "topic", "unit_duration", "day_of_unit", "lesson_theme", "ability_level",
+    "beginner_percent", "intermediate_percent", "advance_percent",
+    "psychomotor_objs", "cognitive_objs", "affective_objs",
+    "venue", "equipment", "safety_concerns", "followup_actions", "self_reflection",
+)
+LESSON_FIELDS = _LESSON_BASE_FIELDS + tuple(f"{key}_zh" for key in _LESSON_BASE_FIELDS)
+_LESSON_ACTIVITY_KEYS = (
+    "intro_activities", "sd_activities", "appli_activities", "ca_activities",
+    "intro_activities_zh", "sd_activities_zh", "appli_activities_zh", "ca_activities_zh",
+)
+# Activity row inputs, e.g. "sd_time_3" or "ca_cues_2_zh"
+ACTIVITY_FIELD_KEY = re.compile(r"(intro|sd|appli|ca)_(time|content|cues|equipment)_(\d+)(_zh)?$")
+# Unit day inputs, e.g. "day_3_theme" or "day_1_date_zh"
+UNIT_DAY_FIELD_KEY = re.compile(r"day_(\d+)_(date|theme|activities)(_zh)?$")
+# Every key of a stored lesson plan, used to presize the plan dict
+LESSON_PLAN_KEYS = ("template_language",) + LESSON_FIELDS + _LESSON_ACTIVITY_KEYS
+
+# Scalar unit plan form fields; each has a matching "_zh" field for the Chinese template
+_UNIT_BASE_FIELDS = (
+    "unit_topic", "number_of_lessons", "period", "class_info", "class_level", "class_size",
+    "boys", "girls", "venue", "equipment", "unit_overview", "skills_topics",
+    "movement_concepts", "previous_knowledge", "learning_outcomes", "assessments",
+    "psychomotor_obj", "cognitive_obj", "affective_obj",
+    "psychomotor_chars", "cognitive_chars", "affective_chars",
+    "psychomotor_notes", "cognitive_notes", "affective_notes",
+    "individual_differences", "enhancing_motivation", "safety_precautions",
+    "other_considerations", "references",
+)
+UNIT_FIELDS = _UNIT_BASE_FIELDS + tuple(f"{key}_zh" for key in _UNIT_BASE_FIELDS)
+# Every key of a stored unit plan, used to presize the plan dict
+UNIT_PLAN_KEYS = ("template_language",) + UNIT_FIELDS + ("unit_contents", "unit_contents_zh")
 
 # Database setup (Supabase Postgres via standard connection URL)
 DATABASE_URL = os.environ.get('DATABASE_URL')
+DB_POOL_MIN = int(os.environ.get('PG_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('PG_POOL_MAX', '10'))
+
+# Server-side prepared statements for hot queries. Leave off behind transaction-mode
+# poolers (e.g. Supabase's port 6543), which do not keep sessions per client.
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS') == '1'
+# Statement names prepared on each pooled connection
+_prepared_statements = weakref.WeakKeyDictionary()
+
+# bcrypt cost for new password hashes; existing hashes keep the cost they were made with
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+# Concurrent bcrypt calls per process; a login that waits longer than BCRYPT_SLOT_WAIT
+# seconds for a slot gets a 503 instead of piling more CPU work onto a saturated box
+BCRYPT_MAX_CONCURRENCY = int(os.environ.get('BCRYPT_MAX_CONCURRENCY', str(os.cpu_count() or 1)))
+BCRYPT_SLOT_WAIT = float(os.environ.get('BCRYPT_SLOT_WAIT', '2'))
+_bcrypt_slots = threading.BoundedSemaphore(BCRYPT_MAX_CONCURRENCY)
+# Failed logins allowed per (client, username) within the window before answering 429.
+# Per process only; put a shared store in front if running many instances.
+LOGIN_MAX_FAILURES = int(os.environ.get('LOGIN_MAX_FAILURES', '5'))
+LOGIN_FAILURE_WINDOW = int(os.environ.get('LOGIN_FAILURE_WINDOW', '60'))
+# Kept in window-start order and capped, so a flood of distinct keys can't grow it unbounded
+LOGIN_FAILURE_KEYS_MAX = 10000
+_login_failures = {}
+_login_failures_lock = threading.Lock()
+# Created on first use so imports (and serverless cold starts) never block on Postgres
 db_pool = None
-if DATABASE_URL and psycopg2:
-    db_pool = pool.SimpleConnectionPool(1, 5, DATABASE_URL, sslmode='require')
+_db_pool_lock = threading.Lock()
 
 # Object storage (S3-compatible, e.g., Supabase storage)
 STORAGE_BUCKET = os.environ.get('STORAGE_BUCKET')
@@ -48,92 +191,278 @@ STORAGE_ACCESS_KEY = os.environ.get('STORAGE_ACCESS_KEY')
 STORAGE_SECRET_KEY = os.environ.get('STORAGE_SECRET_KEY')
 
 STORAGE_ENABLED = all([STORAGE_BUCKET, STORAGE_ACCESS_KEY, STORAGE_SECRET_KEY])
+# boto3 takes hundreds of ms to import, so the client is built on the first upload
 s3_client = None
+_s3_client_lock = threading.Lock()
 if STORAGE_ENABLED:
-    s3_client = boto3.client(
-        "s3",
-        endpoint_url=STORAGE_ENDPOINT,
-        region_name=STORAGE_REGION,
-        aws_access_key_id=STORAGE_ACCESS_KEY,
-        aws_secret_access_key=STORAGE_SECRET_KEY,
-    )
     if not STORAGE_PUBLIC_BASE:
         base_endpoint = STORAGE_ENDPOINT.rstrip("/") if STORAGE_ENDPOINT else f"https://{STORAGE_BUCKET}.s3.amazonaws.com"
         STORAGE_PUBLIC_BASE = f"{base_endpoint}/{STORAGE_BUCKET}".rstrip("/")
 
+# Whether diagrams may be embedded in plan_data as base64 when no storage is available.
+# Inline copies bloat every fetch of the plan row; set to 0 to drop the diagram instead.
+INLINE_DIAGRAMS = os.environ.get('INLINE_DIAGRAMS', '1') == '1'
+
+# Local disk fallback for diagrams when object storage is not configured
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR')
+UPLOAD_URL_PREFIX = "/uploads"
+if UPLOAD_DIR:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+
+def diagram_mime_type(filename: str):
+    """Return the canonical MIME type for an allowed diagram filename, else None."""
+    _, sep, ext = filename.rpartition('.')
+    return DIAGRAM_MIME_TYPES.get(ext.lower()) if sep else None
+
+
+def diagram_object_name(filename: str) -> str:
+    """Fresh fixed-length name for a validated diagram, keeping only its extension."""
+    return f"{uuid.uuid4().hex}.{filename.rpartition('.')[2].lower()}"
+
+
+class DiagramStorageError(Exception):
+    """Configured object storage rejected or failed a diagram upload."""
+
 
-def allowed_file(filename: str) -> bool:
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def get_s3_client():
+    """Return the shared S3 client, importing boto3 and creating it on first use."""
+    global s3_client
+    if s3_client is None:
+        with _s3_client_lock:
+            if s3_client is None:
+                import boto3
+                from botocore.config import Config
 
+                s3_client = boto3.client(
+                    "s3",
+                    endpoint_url=STORAGE_ENDPOINT,
+                    region_name=STORAGE_REGION,
+                    aws_access_key_id=STORAGE_ACCESS_KEY,
+                    aws_secret_access_key=STORAGE_SECRET_KEY,
+                    # One pooled connection per upload worker, kept alive between submissions, and a
+                    # single retry so a failing bucket surfaces as a 503 quickly instead of after backoffs.
+                    config=Config(
+                        max_pool_connections=max(10, DIAGRAM_UPLOAD_WORKERS),
+                        retries={"total_max_attempts": 2, "mode": "standard"},
+                        tcp_keepalive=True,
+                    ),
+                )
+    return s3_client
 
-def upload_to_object_storage(file_obj):
+
+def upload_to_object_storage(file_obj, mime_type):
     """Upload to object storage, return public URL or None."""
-    if not STORAGE_ENABLED or not s3_client:
+    if not STORAGE_ENABLED:
         return None
-    key = f"diagrams/{uuid.uuid4()}-{secure_filename(file_obj.filename)}"
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    key = f"diagrams/{diagram_object_name(file_obj.filename)}"
     try:
-        s3_client.upload_fileobj(
-            file_obj,
-            STORAGE_BUCKET,
-            key,
-            ExtraArgs={"ACL": "public-read", "ContentType": file_obj.content_type},
+        # Diagrams are capped at MAX_CONTENT_LENGTH, far below where multipart pays off, so
+        # send one PUT straight from the spooled upload and skip the transfer manager.
+        get_s3_client().put_object(
+            Bucket=STORAGE_BUCKET,
+            Key=key,
+            Body=file_obj.stream,
+            ACL="public-read",
+            ContentType=mime_type,
         )
     except (BotoCoreError, ClientError):
+        app.logger.exception("Diagram upload to bucket %s failed", STORAGE_BUCKET)
         return None
     return f"{STORAGE_PUBLIC_BASE}/{key}"
 
 
-def process_uploaded_file(file_field):
-    """Process uploaded file and return storage URL or base64 fallback."""
-    if file_field not in request.files:
+def save_to_upload_dir(file_obj):
+    """Save to the local upload directory, return its URL or None."""
+    if not UPLOAD_DIR:
+        return None
+    name = diagram_object_name(file_obj.filename)
+    try:
+        file_obj.save(os.path.join(UPLOAD_DIR, name))
+    except OSError:
+        return None
+    # Built without url_for so this can run on upload pool threads
+    return f"{UPLOAD_URL_PREFIX}/{name}"
+
+
+def encode_data_uri(file_obj, mime_type):
+    """Base64-encode an upload into a data URI, reading it in fixed-size chunks."""
+    encoded = bytearray(b"data:%s;base64," % mime_type.encode("ascii"))
+    while True:
+        chunk = file_obj.stream.read(BASE64_CHUNK_SIZE)
+        if not chunk:
+            break
+        encoded += b64encode(chunk)
+    return encoded.decode("ascii")
+
+
+def get_uploaded_file(file_field, files=None):
+    """Return (file, mime_type) for the named upload if it is an allowed image, else None.
+
+    The MIME type comes from the extension, never from the client's Content-Type.
+    """
+    if files is None:
+        files = request.files
+    file = files.get(file_field)
+    if not file or not file.filename:
+        return None
+    mime_type = diagram_mime_type(file.filename)
+    return (file, mime_type) if mime_type else None
+
+
+def finish_diagram_jobs(jobs):
+    """Wait until no upload is running, cancelling queued ones once any has failed.
+
+    Uploads read the request's FileStorage streams, so none may outlive the request;
+    the first failure is then re-raised.
+    """
+    _, not_done = wait(jobs, return_when=FIRST_EXCEPTION)
+    for job in not_done:
+        job.cancel()
+    wait(not_done)
+    for job in jobs:
+        if not job.cancelled() and job.exception() is not None:
+            raise job.exception()
+
+
+def store_diagram(file, mime_type):
+    """Store a validated upload and return storage URL, local upload URL or base64 fallback.
+
+    Needs no request context, so it can run on the upload pool. When object storage
+    is configured, a failed upload raises DiagramStorageError rather than quietly
+    inlining a base64 copy that would hide the outage.
+    """
+    if STORAGE_ENABLED:
+        storage_url = upload_to_object_storage(file, mime_type)
+        if not storage_url:
+            raise DiagramStorageError(file.filename)
+        return storage_url
+    file.seek(0)
+    upload_url = save_to_upload_dir(file)
+    if upload_url:
+        return upload_url
+    if not INLINE_DIAGRAMS:
+        app.logger.warning("No diagram storage available; dropping %s", file.filename)
         return None
+    # Fallback to base64 to preserve behavior when no storage is available
+    file.seek(0)
+    return encode_data_uri(file, mime_type)
+
 
-    file = request.files.get(file_field)
-    if file and file.filename and allowed_file(file.filename):
-        storage_url = upload_to_object_storage(file)
-        if storage_url:
-            return storage_url
-        # Fallback to base64 to preserve behavior when storage is unavailable
-        file.seek(0)
-        file_data = file.read()
-        encoded_file = base64.b64encode(file_data).decode('utf-8')
-        mime_type = file.content_type
-        return f"data:{mime_type};base64,{encoded_file}"
+def process_uploaded_file(file_field, files=None):
+    """Process uploaded file and return storage URL, local upload URL or base64 fallback."""
+    upload = get_uploaded_file(file_field, files)
+    if upload:
+        return store_diagram(*upload)
     return None
 
 
+def get_db_pool():
+    global db_pool
+    if db_pool is None:
+        if not (DATABASE_URL and psycopg2):
+            raise RuntimeError("Database is not configured. Set DATABASE_URL.")
+        with _db_pool_lock:
+            if db_pool is None:
+                db_pool = pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL, sslmode='require')
+                atexit.register(db_pool.closeall)
+    return db_pool
+
+
 def get_db_conn():
-    if not db_pool:
-        raise RuntimeError("Database is not configured. Set DATABASE_URL.")
-    return db_pool.getconn()
+    return get_db_pool().getconn()
 
 
 @contextmanager
-def db_cursor():
+def db_cursor(dict_rows: bool = True, read_only: bool = False):
+    """Yield (conn, cursor); pass dict_rows=False for plain tuple rows on narrow hot queries.
+
+    read_only=True runs in autocommit mode, so single SELECTs skip the BEGIN/COMMIT round.
+    """
     conn = get_db_conn()
-    cur = conn.cursor(cursor_factory=extras.RealDictCursor)
+    if read_only:
+        conn.autocommit = True
+    cur = conn.cursor(cursor_factory=extras.RealDictCursor) if dict_rows else conn.cursor()
     try:
         yield conn, cur
-        conn.commit()
+        if not read_only:
+            conn.commit()
     except Exception:
-        conn.rollback()
+        if not read_only:
+            conn.rollback()
         raise
     finally:
+        if read_only and not conn.closed:
+            conn.autocommit = False
         db_pool.putconn(conn)
 
 
+class PasswordHashBusy(Exception):
+    """Every bcrypt slot stayed busy for the whole wait."""
+
+
+@contextmanager
+def bcrypt_slot():
+    """Hold one of the BCRYPT_MAX_CONCURRENCY slots; bcrypt drops the GIL, so slots map to cores."""
+    if not _bcrypt_slots.acquire(timeout=BCRYPT_SLOT_WAIT):
+        raise PasswordHashBusy()
+    try:
+        yield
+    finally:
+        _bcrypt_slots.release()
+
+
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    with bcrypt_slot():
+        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("utf-8")
 
 
 def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+    with bcrypt_slot():
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def login_throttled(key) -> bool:
+    """True when this (client, username) pair has used up its failed attempts."""
+    with _login_failures_lock:
+        entry = _login_failures.get(key)
+        if entry is None:
+            return False
+        if time.monotonic() - entry[1] > LOGIN_FAILURE_WINDOW:
+            del _login_failures[key]
+            return False
+        return entry[0] >= LOGIN_MAX_FAILURES
+
+
+def record_login_failure(key):
+    now = time.monotonic()
+    with _login_failures_lock:
+        count, start = _login_failures.get(key, (0, now))
+        if now - start > LOGIN_FAILURE_WINDOW:
+            count, start = 0, now
+        if count == 0:
+            # New window: re-insert at the end so iteration order stays oldest first
+            _login_failures.pop(key, None)
+            # Drop the oldest windows first (expired ones sort there), keeping the cap hard
+            while len(_login_failures) >= LOGIN_FAILURE_KEYS_MAX:
+                del _login_failures[next(iter(_login_failures))]
+        _login_failures[key] = (count + 1, start)
+
+
+class UserRecord(NamedTuple):
+    id: int
+    username: str
+    password_hash: str
+    role: str
 
 
 def get_user_by_username(username: str):
-    with db_cursor() as (_, cur):
+    with db_cursor(dict_rows=False, read_only=True) as (_, cur):
         cur.execute("SELECT id, username, password_hash, role FROM users WHERE username=%s", (username,))
-        return cur.fetchone()
+        row = cur.fetchone()
+    return UserRecord._make(row) if row else None
 
 
 def create_user(username: str, password: str, role: str):
@@ -143,37 +472,60 @@ def create_user(username: str, password: str, role: str):
             "INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s) RETURNING id, username, role",
             (username, hashed, role),
         )
-        return cur.fetchone()
+        user = cur.fetchone()
+    if role == "professor":
+        # Bumped after the commit, so a query that began before it can't store a stale list
+        with _professors_cache_lock:
+            _PROFESSORS_CACHE["generation"] += 1
+            _PROFESSORS_CACHE["expires"] = 0.0
+    return user
+
+
+# Professor list for the create forms; other processes pick up new sign-ups within the TTL
+PROFESSORS_CACHE_TTL = int(os.environ.get('PROFESSORS_CACHE_TTL', '60'))
+_PROFESSORS_CACHE = {"expires": 0.0, "rows": (), "generation": 0}
+_professors_cache_lock = threading.Lock()
 
 
 def get_professors():
-    with db_cursor() as (_, cur):
+    with _professors_cache_lock:
+        if time.monotonic() < _PROFESSORS_CACHE["expires"]:
+            return _PROFESSORS_CACHE["rows"]
+        generation = _PROFESSORS_CACHE["generation"]
+    with db_cursor(read_only=True) as (_, cur):
         cur.execute("SELECT id, username FROM users WHERE role = 'professor' ORDER BY username")
-        return cur.fetchall()
+        rows = tuple(cur)
+    with _professors_cache_lock:
+        # A professor signed up while we were querying; our rows may predate them
+        if _PROFESSORS_CACHE["generation"] == generation:
+            _PROFESSORS_CACHE.update(rows=rows, expires=time.monotonic() + PROFESSORS_CACHE_TTL)
+    return rows
 
 
-def ensure_professor_student_links(student_id: int, professor_ids):
-    if not professor_ids:
-        return
-    with db_cursor() as (_, cur):
-        for pid in professor_ids:
-            cur.execute(
-                """
-                INSERT INTO professor_student (professor_id, student_id)
-                VALUES (%s, %s)
-                ON CONFLICT DO NOTHING
-                """,
-                (pid, student_id),
-            )
+def insert_professor_student_links(cur, student_id: int, professor_ids):
+    extras.execute_values(
+        cur,
+        """
+        INSERT INTO professor_student (professor_id, student_id)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        """,
+        [(pid, student_id) for pid in professor_ids],
+    )
 
 
 def is_professor_for_student(professor_id: int, student_id: int) -> bool:
-    with db_cursor() as (_, cur):
+    with db_cursor(dict_rows=False, read_only=True) as (_, cur):
         cur.execute(
-            "SELECT 1 FROM professor_student WHERE professor_id=%s AND student_id=%s LIMIT 1",
+            "SELECT EXISTS (SELECT 1 FROM professor_student WHERE professor_id=%s AND student_id=%s)",
             (professor_id, student_id),
         )
-        return cur.fetchone() is not None
+        return cur.fetchone()[0]
+
+
+def parse_professor_ids(values):
+    """Ids from the shared-professor checkboxes; anything but plain ASCII digits is dropped."""
+    return [int(value) for value in values if value.isascii() and value.isdecimal()]
 
 
 def get_current_user():
@@ -203,7 +555,108 @@ def login_required(allow_guest=False):
     return decorator
 
 
-def save_plan_record(table_name: str, owner_id: int, plan_data: dict, shared_professors):
+def collect_activity_rows(form):
+    """Group a lesson form's activity inputs into rows in one pass over its keys.
+
+    Returns {(section, suffix): [(row number, row), ...]} sorted by row number.
+    Rows can be removed client-side, so numbering may have gaps; as before, a row
+    exists only if its time input was submitted.
+    """
+    groups = {}
+    for key, value in form.items():
+        match = ACTIVITY_FIELD_KEY.match(key)
+        if match:
+            section, field, idx, suffix = match.groups()
+            groups.setdefault((section, suffix or ""), {}).setdefault(int(idx), {})[field] = value
+    return {
+        group: [
+            (idx, {
+                "time": fields["time"],
+                "content": fields.get("content"),
+                "cues": fields.get("cues"),
+                "equipment": fields.get("equipment"),
+            })
+            for idx, fields in sorted(rows.items())
+            if "time" in fields
+        ]
+        for group, rows in groups.items()
+    }
+
+
+def collect_unit_days(form):
+    """Group a unit form's day inputs in one pass over its keys.
+
+    Returns {suffix: [day, ...]} for "" and "_zh". Days removed client-side leave gaps
+    in the input numbering; the remaining days (those with a date) are renumbered 1..n.
+    """
+    groups = {"": {}, "_zh": {}}
+    for key, value in form.items():
+        match = UNIT_DAY_FIELD_KEY.match(key)
+        if match:
+            idx, field, suffix = match.groups()
+            groups[suffix or ""].setdefault(int(idx), {})[field] = value
+    return {
+        suffix: [
+            {"day": day, "date": fields["date"], "theme": fields.get("theme"), "activities": fields.get("activities")}
+            for day, fields in enumerate(
+                (fields for _, fields in sorted(days.items()) if "date" in fields), start=1
+            )
+        ]
+        for suffix, days in groups.items()
+    }
+
+
+def revalidated_page(func):
+    """Tag a rendered page with an ETag and answer matching conditional GETs with 304."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        response = make_response(func(*args, **kwargs))
+        # Pages depend on the session, so browsers must revalidate rather than reuse blindly
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.add_etag()
+        return response.make_conditional(request)
+    return wrapper
+
+
+def get_accessible_plan(table_name: str, plan_id: int):
+    """Return (record, user) for a plan the current user may open; 403 otherwise."""
+    user = get_current_user()
+    # Professors' supervision check rides along with the fetch instead of a second query
+    professor_id = user["id"] if user and user.get("role") == "professor" else None
+    record = fetch_plan_record(table_name, plan_id, professor_id)
+    if not record or not can_access_plan(record, user):
+        abort(403)
+    return record, user
+
+
+def render_plan_page(table_name: str, record, user, template_name: str, **context):
+    """Render a saved plan, or answer 304 when the browser already has this exact page.
+
+    Saved plans are never edited, so the page only varies with the plan, the viewer
+    and the deployed templates; the ETag is derived from those without rendering.
+    """
+    etag_source = f"{BUILD_ID}:{table_name}:{record['id']}:{user['id']}:{user['username']}"
+    etag = hashlib.blake2b(etag_source.encode("utf-8"), digest_size=16).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        # Large plans render to hundreds of KB; send the HTML as Jinja produces it
+        response = app.response_class(stream_template(template_name, **context))
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def dump_json(obj) -> str:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj)
+
+
+def save_plan_record(table_name: str, owner_id: int, plan_data: dict, shared_professors, link_professors=False):
+    """Insert a plan; with link_professors, also link the owner to the shared professors in the same transaction."""
     with db_cursor() as (_, cur):
         cur.execute(
             f"""
@@ -211,75 +664,163 @@ def save_plan_record(table_name: str, owner_id: int, plan_data: dict, shared_pro
             VALUES (%s, %s, %s)
             RETURNING id
             """,
-            (owner_id, json.dumps(plan_data), shared_professors or []),
+            (owner_id, extras.Json(plan_data, dumps=dump_json), shared_professors or []),
         )
         row = cur.fetchone()
+        if link_professors and shared_professors:
+            insert_professor_student_links(cur, owner_id, shared_professors)
         return row["id"]
 
 
-def fetch_plan_record(table_name: str, plan_id: int):
-    with db_cursor() as (_, cur):
+def fetch_plan_record(table_name: str, plan_id: int, professor_id=None):
+    """Fetch a plan; given professor_id, also report whether that professor supervises its owner."""
+    with db_cursor(read_only=True) as (_, cur):
+        if professor_id is None:
+            cur.execute(
+                f"""
+                SELECT id, owner_id, plan_data, shared_professors
+                FROM {table_name}
+                WHERE id = %s
+                """,
+                (plan_id,),
+            )
+        else:
+            cur.execute(
+                f"""
+                SELECT p.id, p.owner_id, p.plan_data, p.shared_professors,
+                       EXISTS (
+                           SELECT 1 FROM professor_student ps
+                           WHERE ps.professor_id = %s AND ps.student_id = p.owner_id
+                       ) AS supervised
+                FROM {table_name} p
+                WHERE p.id = %s
+                """,
+                (professor_id, plan_id),
+            )
+        return cur.fetchone()
+
+
+# Row-level form of can_access_plan for single-plan lookups, by role
+PLAN_ACCESS_PREDICATES = {
+    "admin": ("TRUE", 0),
+    "professor": (
+        """p.owner_id = %s
+           OR p.shared_professors @> ARRAY[%s::bigint]
+           OR EXISTS (
+               SELECT 1 FROM professor_student ps
+               WHERE ps.professor_id = %s AND ps.student_id = p.owner_id
+           )""",
+        3,
+    ),
+    "owner": ("p.owner_id = %s", 1),
+}
+
+
+def fetch_lesson_diagram(plan_id: int, section: str, row_index: int, user):
+    """Return (allowed, diagram) for one activity row without loading the rest of plan_data.
+
+    None means the plan doesn't exist; diagram is None when the row has no diagram.
+    """
+    access = user["role"] if user["role"] in ("admin", "professor") else "owner"
+    predicate, uid_count = PLAN_ACCESS_PREDICATES[access]
+    with db_cursor(dict_rows=False, read_only=True) as (_, cur):
         cur.execute(
             f"""
-            SELECT p.id, p.owner_id, p.plan_data, p.shared_professors, p.created_at, u.username as owner_username
-            FROM {table_name} p
-            JOIN users u ON p.owner_id = u.id
+            SELECT ({predicate}) AS allowed, p.plan_data #>> %s AS diagram
+            FROM lesson_plans p
             WHERE p.id = %s
             """,
-            (plan_id,),
+            (user["id"],) * uid_count + ([section, str(row_index), "diagram"], plan_id),
         )
         return cur.fetchone()
 
 
-def list_plans_for_user(table_name: str, user):
+# Plans per list on each dashboard page
+DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', '20'))
+
+
+class PlanSummary(NamedTuple):
+    """Dashboard row for a stored plan; tuple-backed, so no per-row __dict__."""
+    id: int
+    owner_username: str
+    created_at: str
+    title: str
+
+
+# Columns in PlanSummary field order, so rows map straight onto it
+LIST_PLANS_SELECT = """
+    SELECT p.id,
+           u.username as owner_username,
+           to_char(p.created_at, 'YYYY-MM-DD HH24:MI') as created_at,
+           COALESCE(
+               NULLIF(p.plan_data->>'lesson_theme', ''),
+               NULLIF(p.plan_data->>'unit_topic', ''),
+               NULLIF(p.plan_data->>'topic', ''),
+               'Untitled'
+           ) as title
+    FROM {table_name} p
+    JOIN users u ON p.owner_id = u.id
+"""
+
+# Which plans each kind of user may list; {uid} is the viewer's id placeholder.
+# The professor filter is a UNION so each branch can use its own index
+# (owner_id btree, shared_professors GIN, professor_student primary key).
+PLAN_ACCESS_FILTERS = {
+    "admin": "",
+    "professor": """
+        WHERE p.id = ANY(ARRAY(
+            SELECT id FROM {table_name} WHERE owner_id = {uid}
+            UNION
+            SELECT id FROM {table_name} WHERE shared_professors @> ARRAY[{uid}::bigint]
+            UNION
+            SELECT s.id FROM {table_name} s
+            JOIN professor_student ps ON ps.student_id = s.owner_id
+            WHERE ps.professor_id = {uid}
+        ))
+    """,
+    "owner": "WHERE p.owner_id = {uid}",
+}
+
+
+def list_plans_sql(table_name: str, access: str, placeholders: dict) -> str:
+    return (
+        LIST_PLANS_SELECT.format(table_name=table_name)
+        + PLAN_ACCESS_FILTERS[access].format(table_name=table_name, **placeholders)
+        + " ORDER BY p.created_at DESC, p.id DESC LIMIT {limit} OFFSET {offset}".format(**placeholders)
+    )
+
+
+def prepare_statement(conn, cur, name: str, sql: str):
+    """PREPARE a statement once per pooled connection."""
+    prepared = _prepared_statements.setdefault(conn, set())
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        prepared.add(name)
+
+
+def list_plans_for_user(table_name: str, user, limit=None, offset: int = 0):
+    """Summaries of the plans the user may open, newest first; limit=None returns all."""
     if not user or user.get("is_guest"):
         return []
 
-    base_select = f"""
-        SELECT p.id,
-               p.created_at,
-               p.owner_id,
-               u.username as owner_username,
-               p.plan_data,
-               p.shared_professors
-        FROM {table_name} p
-        JOIN users u ON p.owner_id = u.id
-    """
-    params = []
-    where_clause = ""
-
     if user["role"] == "admin":
-        where_clause = ""
+        access = "admin"
     elif user["role"] == "professor":
-        where_clause = """
-            WHERE p.owner_id = %s
-               OR %s = ANY(p.shared_professors)
-               OR EXISTS (
-                   SELECT 1 FROM professor_student ps
-                   WHERE ps.professor_id = %s AND ps.student_id = p.owner_id
-               )
-        """
-        params = [user["id"], user["id"], user["id"]]
+        access = "professor"
     else:
-        where_clause = "WHERE p.owner_id = %s"
-        params = [user["id"]]
-
-    with db_cursor() as (_, cur):
-        cur.execute(base_select + " " + where_clause + " ORDER BY p.created_at DESC", params)
-        rows = cur.fetchall()
-        summarized = []
-        for row in rows:
-            plan_data = row["plan_data"] or {}
-            title = plan_data.get("lesson_theme") or plan_data.get("unit_topic") or plan_data.get("topic") or "Untitled"
-            summarized.append(
-                {
-                    "id": row["id"],
-                    "owner_username": row["owner_username"],
-                    "created_at": row["created_at"].strftime("%Y-%m-%d %H:%M"),
-                    "title": title,
-                }
-            )
-        return summarized
+        access = "owner"
+    params = {} if access == "admin" else {"uid": user["id"]}
+    params.update(limit=limit, offset=offset)
+
+    with db_cursor(dict_rows=False, read_only=True) as (conn, cur):
+        if DB_PREPARED_STATEMENTS:
+            name = f"list_{table_name}_{access}"
+            positional = {key: f"${n}" for n, key in enumerate(params, 1)}
+            prepare_statement(conn, cur, name, list_plans_sql(table_name, access, positional))
+            cur.execute(f"EXECUTE {name} ({', '.join(f'%({key})s' for key in params)})", params)
+        else:
+            cur.execute(list_plans_sql(table_name, access, {key: f"%({key})s" for key in params}), params)
+        return list(map(PlanSummary._make, cur))
 
 
 def can_access_plan(record, user):
@@ -293,17 +834,108 @@ def can_access_plan(record, user):
         shared_professors = record.get("shared_professors") or []
         if user["id"] in shared_professors:
             return True
+        if "supervised" in record:
+            return record["supervised"]
         return is_professor_for_student(user["id"], record["owner_id"])
     return False
 
 
+@app.before_request
+def reject_oversized_request():
+    """Refuse oversized bodies before the multipart parser runs"""
+    content_length = request.content_length
+    if content_length and content_length > app.config['MAX_CONTENT_LENGTH']:
+        abort(413)
+
+
+# Text responses smaller than this are sent as-is; compressing them saves next to nothing
+COMPRESS_MIN_SIZE = 512
+COMPRESSIBLE_MIMETYPES = ("text/", "application/json")
+
+
+def compress_chunks(chunks, encoding):
+    """Compress a streamed body incrementally; the compressor buffers tiny Jinja chunks."""
+    compressor = brotli.Compressor(quality=4) if encoding == "br" else zlib.compressobj(4, wbits=31)
+    try:
+        for chunk in chunks:
+            data = compressor.process(chunk) if encoding == "br" else compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish() if encoding == "br" else compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+@app.after_request
+def compress_response(response):
+    """Brotli- or gzip-encode text responses for clients that accept it"""
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or not response.mimetype.startswith(COMPRESSIBLE_MIMETYPES)
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(("br", "gzip") if BROTLI_AVAILABLE else ("gzip",))
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.iter_encoded(), encoding)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(brotli.compress(data, quality=4) if encoding == "br" else gzip.compress(data, compresslevel=4))
+    response.content_encoding = encoding
+    # The encoded body differs byte-wise from the identity one, so its validator is weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+class LazyString:
+    """String built on first use; Jinja calls __str__ only if a template renders it."""
+    __slots__ = ("_func",)
+
+    def __init__(self, func):
+        self._func = func
+
+    def __str__(self):
+        return self._func()
+
+
+@app.errorhandler(DiagramStorageError)
+def diagram_storage_error(error):
+    return "Diagram storage is temporarily unavailable. Please go back and submit the plan again.", 503
+
+
+@app.errorhandler(PasswordHashBusy)
+def password_hash_busy(error):
+    response = make_response("The server is busy signing people in. Please try again in a moment.", 503)
+    response.retry_after = 1
+    return response
+
+
 @app.context_processor
 def inject_feedback_data():
     """Make current URL and user available to all templates for feedback links"""
-    return dict(current_url=request.url, current_user=get_current_user())
+    return dict(current_url=LazyString(get_current_url), current_user=get_current_user())
+
+
+def get_current_url():
+    """request.url, built once per request however many templates render it"""
+    if "current_url" not in g:
+        g.current_url = request.url
+    return g.current_url
 
 
 @app.route("/")
+@revalidated_page
 def index():
     return render_template("index.html")
 
@@ -332,11 +964,19 @@ def login():
                 set_current_user({"id": user["id"], "username": user["username"], "role": user["role"], "is_guest": False})
                 return redirect(next_url or url_for("dashboard"))
         else:
+            throttle_key = (request.remote_addr, username.lower())
+            if login_throttled(throttle_key):
+                message = "Too many failed attempts. Please wait a minute and try again."
+                return render_template("login.html", message=message, next_url=next_url), 429
             user = get_user_by_username(username)
-            if not user or not verify_password(password, user["password_hash"]):
+            if not user or not verify_password(password, user.password_hash):
+                record_login_failure(throttle_key)
                 message = "Invalid credentials."
             else:
-                set_current_user({"id": user["id"], "username": user["username"], "role": user["role"], "is_guest": False})
+                # A successful login forgives earlier typos, so they can't add up to a lockout
+                with _login_failures_lock:
+                    _login_failures.pop(throttle_key, None)
+                set_current_user({"id": user.id, "username": user.username, "role": user.role, "is_guest": False})
                 return redirect(next_url or url_for("dashboard"))
 
     return render_template("login.html", message=message, next_url=next_url)
@@ -358,13 +998,31 @@ def logout():
 @login_required(allow_guest=True)
 def dashboard():
     user = get_current_user()
-    lesson_rows = list_plans_for_user("lesson_plans", user)
-    unit_rows = list_plans_for_user("unit_plans", user)
-    return render_template("dashboard.html", lesson_plans=lesson_rows, unit_plans=unit_rows)
+    # Each list pages on its own so a short list doesn't blank out on later pages
+    lesson_page = max(request.args.get("lesson_page", 1, type=int), 1)
+    unit_page = max(request.args.get("unit_page", 1, type=int), 1)
+    lesson_rows = list_dashboard_page("lesson_plans", user, lesson_page)
+    unit_rows = list_dashboard_page("unit_plans", user, unit_page)
+    return render_template(
+        "dashboard.html",
+        lesson_plans=lesson_rows[:DASHBOARD_PAGE_SIZE],
+        unit_plans=unit_rows[:DASHBOARD_PAGE_SIZE],
+        lesson_page=lesson_page,
+        unit_page=unit_page,
+        lesson_has_next=len(lesson_rows) > DASHBOARD_PAGE_SIZE,
+        unit_has_next=len(unit_rows) > DASHBOARD_PAGE_SIZE,
+    )
+
+
+def list_dashboard_page(table_name: str, user, page: int):
+    # One extra row tells us whether there is a next page
+    offset = (page - 1) * DASHBOARD_PAGE_SIZE
+    return list_plans_for_user(table_name, user, DASHBOARD_PAGE_SIZE + 1, offset)
 
 
 @app.route("/create-lesson", methods=["GET"])
 @login_required(allow_guest=True)
+@revalidated_page
 def create_lesson_form():
     default_values = get_lesson_default_values()
     professors = get_professors()
@@ -373,6 +1031,7 @@ def create_lesson_form():
 
 @app.route("/create-unit", methods=["GET"])
 @login_required(allow_guest=True)
+@revalidated_page
 def create_unit_form():
     default_values = get_unit_default_values()
     professors = get_professors()
@@ -383,183 +1042,60 @@ def create_unit_form():
 @login_required()
 def create_lesson():
     user = get_current_user()
-    shared_professors = [int(p) for p in request.form.getlist("shared_professors") if p]
-
-    template_language = request.form.get("template_language", "english")
-    teacher_name = request.form.get("teacher_name")
-    pesh_year = request.form.get("pesh_year")
-    date = request.form.get("date")
-    class_duration = request.form.get("class_duration")
-    start_time = request.form.get("start_time")
-    end_time = request.form.get("end_time")
-    school_name = request.form.get("school_name")
-    year = request.form.get("year")
-    class_id = request.form.get("class_id")
-    class_level = request.form.get("class_level")
-    class_size = request.form.get("class_size")
-    boys = request.form.get("boys")
-    girls = request.form.get("girls")
-    topic = request.form.get("topic")
-    unit_duration = request.form.get("unit_duration")
-    day_of_unit = request.form.get("day_of_unit")
-    lesson_theme = request.form.get("lesson_theme")
-    ability_level = request.form.get("ability_level")
-    beginner_percent = request.form.get("beginner_percent")
-    intermediate_percent = request.form.get("intermediate_percent")
-    advance_percent = request.form.get("advance_percent")
-    psychomotor_objs = request.form.get("psychomotor_objs")
-    cognitive_objs = request.form.get("cognitive_objs")
-    affective_objs = request.form.get("affective_objs")
-    venue = request.form.get("venue")
-    equipment = request.form.get("equipment")
-    safety_concerns = request.form.get("safety_concerns")
+    shared_professors = parse_professor_ids(request.form.getlist("shared_professors"))
+
+    form = request.form.to_dict()
+    files = request.files
+    new_plan = dict.fromkeys(LESSON_PLAN_KEYS)
+    new_plan["template_language"] = form.get("template_language", "english")
+    new_plan.update(zip(LESSON_FIELDS, map(form.get, LESSON_FIELDS)))
+
+    activity_rows = collect_activity_rows(form)
+    pending_diagrams = []
 
     def get_activity_rows(section, lang=""):
         suffix = "_zh" if lang == "zh" else ""
         rows = []
-        idx = 1
-        while True:
-            time_key = f"{section}_time_{idx}{suffix}"
-            if time_key not in request.form:
-                break
-            row = {
-                "time": request.form.get(time_key),
-                "content": request.form.get(f"{section}_content_{idx}{suffix}"),
-                "cues": request.form.get(f"{section}_cues_{idx}{suffix}"),
-                "equipment": request.form.get(f"{section}_equipment_{idx}{suffix}"),
-            }
-            file_key = f"{section}_file_{idx}{suffix}"
-            diagram = process_uploaded_file(file_key)
-            if diagram:
-                row["diagram"] = diagram
+        for idx, row in activity_rows.get((section, suffix), ()):
+            upload = get_uploaded_file(f"{section}_file_{idx}{suffix}", files)
+            if upload:
+                pending_diagrams.append((row, _upload_pool.submit(store_diagram, *upload)))
             rows.append(row)
-            idx += 1
         return rows
 
-    intro_activities = get_activity_rows("intro", "")
-    sd_activities = get_activity_rows("sd", "")
-    appli_activities = get_activity_rows("appli", "")
-    ca_activities = get_activity_rows("ca", "")
-
-    if not intro_activities:
-        intro_activities = [{
-            "time": request.form.get("intro_time"),
-            "cues": request.form.get("intro_cues"),
-            "equipment": request.form.get("intro_equipment"),
-            "diagram": process_uploaded_file("intro_file"),
-        }]
-
-    followup_actions = request.form.get("followup_actions")
-    self_reflection = request.form.get("self_reflection")
-
-    teacher_name_zh = request.form.get("teacher_name_zh")
-    pesh_year_zh = request.form.get("pesh_year_zh")
-    date_zh = request.form.get("date_zh")
-    class_duration_zh = request.form.get("class_duration_zh")
-    start_time_zh = request.form.get("start_time_zh")
-    end_time_zh = request.form.get("end_time_zh")
-    school_name_zh = request.form.get("school_name_zh")
-    year_zh = request.form.get("year_zh")
-    class_id_zh = request.form.get("class_id_zh")
-    class_level_zh = request.form.get("class_level_zh")
-    class_size_zh = request.form.get("class_size_zh")
-    boys_zh = request.form.get("boys_zh")
-    girls_zh = request.form.get("girls_zh")
-    unit_duration_zh = request.form.get("unit_duration_zh")
-    day_of_unit_zh = request.form.get("day_of_unit_zh")
-    topic_zh = request.form.get("topic_zh")
-    lesson_theme_zh = request.form.get("lesson_theme_zh")
-    ability_level_zh = request.form.get("ability_level_zh")
-    beginner_percent_zh = request.form.get("beginner_percent_zh")
-    intermediate_percent_zh = request.form.get("intermediate_percent_zh")
-    advance_percent_zh = request.form.get("advance_percent_zh")
-    psychomotor_objs_zh = request.form.get("psychomotor_objs_zh")
-    cognitive_objs_zh = request.form.get("cognitive_objs_zh")
-    affective_objs_zh = request.form.get("affective_objs_zh")
-    venue_zh = request.form.get("venue_zh")
-    equipment_zh = request.form.get("equipment_zh")
-    safety_concerns_zh = request.form.get("safety_concerns_zh")
-    followup_actions_zh = request.form.get("followup_actions_zh")
-    self_reflection_zh = request.form.get("self_reflection_zh")
-
-    intro_activities_zh = get_activity_rows("intro", "zh")
-    sd_activities_zh = get_activity_rows("sd", "zh")
-    appli_activities_zh = get_activity_rows("appli", "zh")
-    ca_activities_zh = get_activity_rows("ca", "zh")
-
-    new_plan = {
-        "template_language": template_language,
-        "teacher_name": teacher_name,
-        "pesh_year": pesh_year,
-        "date": date,
-        "class_duration": class_duration,
-        "start_time": start_time,
-        "end_time": end_time,
-        "school_name": school_name,
-        "year": year,
-        "class_id": class_id,
-        "class_level": class_level,
-        "class_size": class_size,
-        "boys": boys,
-        "girls": girls,
-        "topic": topic,
-        "unit_duration": unit_duration,
-        "day_of_unit": day_of_unit,
-        "lesson_theme": lesson_theme,
-        "ability_level": ability_level,
-        "beginner_percent": beginner_percent,
-        "intermediate_percent": intermediate_percent,
-        "advance_percent": advance_percent,
-        "psychomotor_objs": psychomotor_objs,
-        "cognitive_objs": cognitive_objs,
-        "affective_objs": affective_objs,
-        "venue": venue,
-        "equipment": equipment,
-        "safety_concerns": safety_concerns,
-        "intro_activities": intro_activities,
-        "sd_activities": sd_activities,
-        "appli_activities": appli_activities,
-        "ca_activities": ca_activities,
-        "followup_actions": followup_actions,
-        "self_reflection": self_reflection,
-        "teacher_name_zh": teacher_name_zh,
-        "pesh_year_zh": pesh_year_zh,
-        "date_zh": date_zh,
-        "class_duration_zh": class_duration_zh,
-        "start_time_zh": start_time_zh,
-        "end_time_zh": end_time_zh,
-        "school_name_zh": school_name_zh,
-        "year_zh": year_zh,
-        "class_id_zh": class_id_zh,
-        "class_level_zh": class_level_zh,
-        "class_size_zh": class_size_zh,
-        "boys_zh": boys_zh,
-        "girls_zh": girls_zh,
-        "unit_duration_zh": unit_duration_zh,
-        "day_of_unit_zh": day_of_unit_zh,
-        "topic_zh": topic_zh,
-        "lesson_theme_zh": lesson_theme_zh,
-        "ability_level_zh": ability_level_zh,
-        "beginner_percent_zh": beginner_percent_zh,
-        "intermediate_percent_zh": intermediate_percent_zh,
-        "advance_percent_zh": advance_percent_zh,
-        "psychomotor_objs_zh": psychomotor_objs_zh,
-        "cognitive_objs_zh": cognitive_objs_zh,
-        "affective_objs_zh": affective_objs_zh,
-        "venue_zh": venue_zh,
-        "equipment_zh": equipment_zh,
-        "safety_concerns_zh": safety_concerns_zh,
-        "intro_activities_zh": intro_activities_zh,
-        "sd_activities_zh": sd_activities_zh,
-        "appli_activities_zh": appli_activities_zh,
-        "ca_activities_zh": ca_activities_zh,
-        "followup_actions_zh": followup_actions_zh,
-        "self_reflection_zh": self_reflection_zh,
-    }
-
-    plan_id = save_plan_record("lesson_plans", user["id"], new_plan, shared_professors)
-    if user["role"] == "student-teacher":
-        ensure_professor_student_links(user["id"], shared_professors)
+    try:
+        intro_activities = get_activity_rows("intro", "")
+        if not intro_activities:
+            intro_activities = [{
+                "time": form.get("intro_time"),
+                "cues": form.get("intro_cues"),
+                "equipment": form.get("intro_equipment"),
+                "diagram": process_uploaded_file("intro_file", files),
+            }]
+
+        new_plan.update(
+            {
+                "intro_activities": intro_activities,
+                "sd_activities": get_activity_rows("sd", ""),
+                "appli_activities": get_activity_rows("appli", ""),
+                "ca_activities": get_activity_rows("ca", ""),
+                "intro_activities_zh": get_activity_rows("intro", "zh"),
+                "sd_activities_zh": get_activity_rows("sd", "zh"),
+                "appli_activities_zh": get_activity_rows("appli", "zh"),
+                "ca_activities_zh": get_activity_rows("ca", "zh"),
+            }
+        )
+    finally:
+        finish_diagram_jobs([job for _, job in pending_diagrams])
+    for row, job in pending_diagrams:
+        diagram = job.result()
+        if diagram:
+            row["diagram"] = diagram
+
+    plan_id = save_plan_record(
+        "lesson_plans", user["id"], new_plan, shared_professors,
+        link_professors=user["role"] == "student-teacher",
+    )
 
     return redirect(url_for("view_lesson_plan", plan_id=plan_id))
 
@@ -568,166 +1104,132 @@ def create_lesson():
 @login_required()
 def create_unit():
     user = get_current_user()
-    shared_professors = [int(p) for p in request.form.getlist("shared_professors") if p]
-
-    template_language = request.form.get("template_language", "english")
-    unit_data = {
-        "template_language": template_language,
-        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "unit_topic": request.form.get("unit_topic"),
-        "number_of_lessons": request.form.get("number_of_lessons"),
-        "period": request.form.get("period"),
-        "class_info": request.form.get("class_info"),
-        "class_level": request.form.get("class_level"),
-        "class_size": request.form.get("class_size"),
-        "boys": request.form.get("boys"),
-        "girls": request.form.get("girls"),
-        "venue": request.form.get("venue"),
-        "equipment": request.form.get("equipment"),
-        "unit_overview": request.form.get("unit_overview"),
-        "skills_topics": request.form.get("skills_topics"),
-        "movement_concepts": request.form.get("movement_concepts"),
-        "previous_knowledge": request.form.get("previous_knowledge"),
-        "learning_outcomes": request.form.get("learning_outcomes"),
-        "assessments": request.form.get("assessments"),
-        "psychomotor_obj": request.form.get("psychomotor_obj"),
-        "cognitive_obj": request.form.get("cognitive_obj"),
-        "affective_obj": request.form.get("affective_obj"),
-        "psychomotor_chars": request.form.get("psychomotor_chars"),
-        "cognitive_chars": request.form.get("cognitive_chars"),
-        "affective_chars": request.form.get("affective_chars"),
-        "psychomotor_notes": request.form.get("psychomotor_notes"),
-        "cognitive_notes": request.form.get("cognitive_notes"),
-        "affective_notes": request.form.get("affective_notes"),
-        "individual_differences": request.form.get("individual_differences"),
-        "enhancing_motivation": request.form.get("enhancing_motivation"),
-        "safety_precautions": request.form.get("safety_precautions"),
-        "other_considerations": request.form.get("other_considerations"),
-        "references": request.form.get("references"),
-        "unit_contents": [],
-    }
+    shared_professors = parse_professor_ids(request.form.getlist("shared_professors"))
 
-    day_num = 1
-    while True:
-        date_key = f"day_{day_num}_date"
-        if date_key not in request.form:
-            break
-        day_data = {
-            "day": day_num,
-            "date": request.form.get(date_key),
-            "theme": request.form.get(f"day_{day_num}_theme"),
-            "activities": request.form.get(f"day_{day_num}_activities"),
-        }
-        unit_data["unit_contents"].append(day_data)
-        day_num += 1
-
-    unit_data.update(
-        {
-            "unit_topic_zh": request.form.get("unit_topic_zh"),
-            "number_of_lessons_zh": request.form.get("number_of_lessons_zh"),
-            "period_zh": request.form.get("period_zh"),
-            "class_info_zh": request.form.get("class_info_zh"),
-            "class_level_zh": request.form.get("class_level_zh"),
-            "class_size_zh": request.form.get("class_size_zh"),
-            "boys_zh": request.form.get("boys_zh"),
-            "girls_zh": request.form.get("girls_zh"),
-            "venue_zh": request.form.get("venue_zh"),
-            "equipment_zh": request.form.get("equipment_zh"),
-            "unit_overview_zh": request.form.get("unit_overview_zh"),
-            "skills_topics_zh": request.form.get("skills_topics_zh"),
-            "movement_concepts_zh": request.form.get("movement_concepts_zh"),
-            "previous_knowledge_zh": request.form.get("previous_knowledge_zh"),
-            "learning_outcomes_zh": request.form.get("learning_outcomes_zh"),
-            "assessments_zh": request.form.get("assessments_zh"),
-            "psychomotor_obj_zh": request.form.get("psychomotor_obj_zh"),
-            "cognitive_obj_zh": request.form.get("cognitive_obj_zh"),
-            "affective_obj_zh": request.form.get("affective_obj_zh"),
-            "psychomotor_chars_zh": request.form.get("psychomotor_chars_zh"),
-            "cognitive_chars_zh": request.form.get("cognitive_chars_zh"),
-            "affective_chars_zh": request.form.get("affective_chars_zh"),
-            "psychomotor_notes_zh": request.form.get("psychomotor_notes_zh"),
-            "cognitive_notes_zh": request.form.get("cognitive_notes_zh"),
-            "affective_notes_zh": request.form.get("affective_notes_zh"),
-            "individual_differences_zh": request.form.get("individual_differences_zh"),
-            "enhancing_motivation_zh": request.form.get("enhancing_motivation_zh"),
-            "safety_precautions_zh": request.form.get("safety_precautions_zh"),
-            "other_considerations_zh": request.form.get("other_considerations_zh"),
-            "references_zh": request.form.get("references_zh"),
-        }
-    )
+    form = request.form.to_dict()
+    unit_data = dict.fromkeys(UNIT_PLAN_KEYS)
+    unit_data["template_language"] = form.get("template_language", "english")
+    unit_data.update(zip(UNIT_FIELDS, map(form.get, UNIT_FIELDS)))
 
-    unit_data["unit_contents_zh"] = []
-    day_num = 1
-    while True:
-        date_key = f"day_{day_num}_date_zh"
-        if date_key not in request.form:
-            break
-        day_data_zh = {
-            "day": day_num,
-            "date": request.form.get(date_key),
-            "theme": request.form.get(f"day_{day_num}_theme_zh"),
-            "activities": request.form.get(f"day_{day_num}_activities_zh"),
-        }
-        unit_data["unit_contents_zh"].append(day_data_zh)
-        day_num += 1
-
-    plan_id = save_plan_record("unit_plans", user["id"], unit_data, shared_professors)
-    if user["role"] == "student-teacher":
-        ensure_professor_student_links(user["id"], shared_professors)
+    unit_days = collect_unit_days(form)
+    unit_data["unit_contents"] = unit_days[""]
+    unit_data["unit_contents_zh"] = unit_days["_zh"]
+
+    plan_id = save_plan_record(
+        "unit_plans", user["id"], unit_data, shared_professors,
+        link_professors=user["role"] == "student-teacher",
+    )
     return redirect(url_for("view_unit_plan", plan_id=plan_id))
 
 
 @app.route("/lesson/<int:plan_id>")
 @login_required()
 def view_lesson_plan(plan_id):
-    user = get_current_user()
-    record = fetch_plan_record("lesson_plans", plan_id)
-    if not record or not can_access_plan(record, user):
+    record, user = get_accessible_plan("lesson_plans", plan_id)
+    plan = record["plan_data"] or {}
+    # Point inline base64 diagrams at the cacheable diagram route instead of embedding them;
+    # plan_data is decoded fresh for each fetch, so rewriting it in place is safe
+    for section in _LESSON_ACTIVITY_KEYS:
+        for row_index, row in enumerate(plan.get(section) or ()):
+            if (row.get("diagram") or "").startswith("data:"):
+                row["diagram"] = url_for("lesson_diagram", plan_id=plan_id, section=section, row_index=row_index)
+    return render_plan_page("lesson_plans", record, user, "view_lesson_plan.html", plan=plan, plan_id=record["id"])
+
+
+@app.route("/lesson/<int:plan_id>/diagram/<section>/<int:row_index>")
+@login_required()
+def lesson_diagram(plan_id, section, row_index):
+    """Serve a diagram stored inline as a base64 data URI"""
+    # Only the one diagram string leaves the database, not the whole plan per image
+    found = fetch_lesson_diagram(plan_id, section, row_index, get_current_user())
+    if not found or not found[0]:
         abort(403)
-    plan_payload = dict(record["plan_data"] or {})
-    plan_payload["id"] = record["id"]
-    return render_template("view_lesson_plan.html", plan=plan_payload)
+    if section not in _LESSON_ACTIVITY_KEYS:
+        abort(404)
+    header, sep, payload = (found[1] or "").partition(",")
+    if not sep or not header.startswith("data:") or not header.endswith(";base64"):
+        abort(404)
+    response = make_response(b64decode(payload))
+    response.mimetype = header[len("data:"):-len(";base64")]
+    # Saved plans never change, so the browser may keep the image for good
+    response.cache_control.private = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return harden_uploaded_image(response)
 
 
 @app.route("/unit/<int:plan_id>")
 @login_required()
 def view_unit_plan(plan_id):
-    user = get_current_user()
-    record = fetch_plan_record("unit_plans", plan_id)
-    if not record or not can_access_plan(record, user):
-        abort(403)
-    plan_payload = dict(record["plan_data"] or {})
-    plan_payload["id"] = record["id"]
-    return render_template("view_unit_plan.html", plan=plan_payload)
+    record, user = get_accessible_plan("unit_plans", plan_id)
+    return render_plan_page(
+        "unit_plans", record, user, "view_unit_plan.html", plan=record["plan_data"] or {}, plan_id=record["id"]
+    )
 
 
 @app.route("/diagram-tool")
+@revalidated_page
 def diagram_tool():
     return render_template("diagram_tool.html")
 
 
+@app.route(f"{UPLOAD_URL_PREFIX}/<path:name>")
+def uploaded_file(name):
+    """Serve diagrams saved to the local upload directory"""
+    if not UPLOAD_DIR:
+        abort(404)
+    # Stored under a fresh uuid and never overwritten, so the browser may keep it for good
+    response = send_from_directory(UPLOAD_DIR, name, conditional=True, max_age=31536000)
+    response.cache_control.immutable = True
+    return harden_uploaded_image(response)
+
+
+def harden_uploaded_image(response):
+    """Stop user-uploaded images (notably SVG) from running script when opened directly"""
+    response.headers["Content-Security-Policy"] = "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    return response
+
+
+# Rendered TOS.md, re-rendered only when the file's mtime changes
+TOS_PATH = os.path.join(os.path.dirname(__file__), "TOS.md")
+_TOS_CACHE = {"mtime": None, "html": None}
+
+
 @app.route("/TOS.md")
+@revalidated_page
 def tos():
     """Serve the Terms of Service document"""
-    tos_path = os.path.join(os.path.dirname(__file__), "TOS.md")
-    if os.path.exists(tos_path):
-        with open(tos_path, "r", encoding="utf-8") as f:
-            tos_content = f.read()
+    try:
+        mtime = os.stat(TOS_PATH).st_mtime
+    except FileNotFoundError:
+        return "Terms of Service not found", 404
+
+    if _TOS_CACHE["mtime"] != mtime:
+        with open(TOS_PATH, "rb") as f:
+            tos_content = f.read().decode("utf-8")
 
         if MARKDOWN_AVAILABLE:
+            import markdown
+
             html_content = markdown.markdown(tos_content, extensions=["extra", "nl2br"])
         else:
-            html_content = "<pre>" + tos_content + "</pre>"
+            html_content = Markup("<pre>%s</pre>") % tos_content
+        _TOS_CACHE.update(mtime=mtime, html=html_content)
 
-        return render_template("tos.html", tos_content=html_content)
-    return "Terms of Service not found", 404
+    return render_template("tos.html", tos_content=_TOS_CACHE["html"])
 
 
 def get_lesson_default_values():
-    """Return default values for the form"""
-    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%d/%m/%Y")
+    """Return default values for the form (read-only; shared for the whole day)"""
+    return _lesson_defaults_for(date.today())
 
-    return {
+
+@lru_cache(maxsize=2)
+def _lesson_defaults_for(today):
+    tomorrow = (today + timedelta(days=1)).strftime("%d/%m/%Y")
+
+    return MappingProxyType({
         "default_teacher": "John Smith",
         "default_pesh_year": 2,
         "default_date": tomorrow,
@@ -788,15 +1290,20 @@ def get_lesson_default_values():
         "default_ca_equip_zh": "不需要",
         "default_followup_zh": "在家練習原地運球",
         "default_reflection_zh": "學生對視覺演示反應良好",
-    }
+    })
 
 
 def get_unit_default_values():
-    """Return default values for unit plan form"""
-    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%d/%m/%Y")
-    end_date = (datetime.now() + timedelta(days=30)).strftime("%d/%m/%Y")
+    """Return default values for unit plan form (read-only; shared for the whole day)"""
+    return _unit_defaults_for(date.today())
 
-    return {
+
+@lru_cache(maxsize=2)
+def _unit_defaults_for(today):
+    tomorrow = (today + timedelta(days=1)).strftime("%d/%m/%Y")
+    end_date = (today + timedelta(days=30)).strftime("%d/%m/%Y")
+
+    return MappingProxyType({
         "default_unit_topic": "Basketball Fundamentals Unit",
         "default_number_lessons": 5,
         "default_period": f"{tomorrow} to {end_date}",
@@ -811,10 +1318,20 @@ def get_unit_default_values():
         "default_class_zh": "五甲班",
         "default_venue_zh": "學校體育館",
         "default_equipment_zh": "籃球、雪糕筒、哨子、號碼衣",
-    }
+    })
+
 
+if not app.debug:
+    # Production: compile templates once, cache their bytecode and skip mtime checks.
+    # Flask reads FLASK_DEBUG when the app is created, so `flask run` in debug mode skips this.
+    app.config["TEMPLATES_AUTO_RELOAD"] = False
+    app.jinja_env.auto_reload = False
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    debug = os.environ.get("FLASK_DEBUG") == "1"
+    app.run(debug=debug, use_reloader=debug, threaded=True)
 else:
     application = app
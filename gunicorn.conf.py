@@ -0,0 +1,9 @@
+# Gunicorn settings for self-hosted deployments (Vercel ignores this file).
+# Threaded workers let one thread encode/store diagrams while another is
+# still receiving a slow multipart upload.
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
@@ -0,0 +1,51 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app
+
+
+def test_failed_upload_leaves_no_upload_running(monkeypatch):
+    started, finished = [], []
+    slow_started = threading.Event()
+
+    def fake_store(file, mime_type):
+        if file.filename == "bad.png":
+            slow_started.wait(1)
+            raise app.DiagramStorageError(file.filename)
+        started.append(file.filename)
+        slow_started.set()
+        time.sleep(0.2)
+        finished.append(file.filename)
+        return "https://example.invalid/" + file.filename
+
+    monkeypatch.setattr(app, "store_diagram", fake_store)
+    monkeypatch.setattr(app, "save_plan_record", lambda *args, **kwargs: 1)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session["user"] = {"id": 7, "username": "stud", "role": "student-teacher", "is_guest": False}
+
+    data = {
+        "intro_time_1": "5", "intro_file_1": (io.BytesIO(b"\x89PNG"), "bad.png"),
+        "sd_time_1": "5", "sd_file_1": (io.BytesIO(b"\x89PNG"), "slow.png"),
+    }
+    response = client.post("/create-lesson", data=data, content_type="multipart/form-data")
+
+    assert response.status_code == 503
+    # The slow upload was already running when the other failed, so the request waited for it
+    assert started == finished == ["slow.png"]
+
+
+def test_finish_diagram_jobs_cancels_queued_uploads():
+    def fail():
+        raise app.DiagramStorageError("bad.png")
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        jobs = [pool.submit(fail), pool.submit(time.sleep, 0.2), pool.submit(time.sleep, 0.2)]
+        with pytest.raises(app.DiagramStorageError):
+            app.finish_diagram_jobs(jobs)
+        assert all(job.done() for job in jobs)
+        assert jobs[2].cancelled()
@@ -0,0 +1,39 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(autouse=True)
+def fresh_failures(monkeypatch):
+    monkeypatch.setattr(app, "_login_failures", {})
+    monkeypatch.setattr(app, "LOGIN_MAX_FAILURES", 5)
+    user = app.UserRecord(1, "stud", "hash", "student-teacher")
+    monkeypatch.setattr(app, "get_user_by_username", lambda username: user)
+    monkeypatch.setattr(app, "verify_password", lambda password, hashed: password == "right")
+
+
+def login(client, password):
+    return client.post("/login", data={"username": "stud", "password": password}).status_code
+
+
+def test_successful_login_clears_failures():
+    client = app.app.test_client()
+    assert [login(client, "wrong") for _ in range(4)] == [200] * 4
+    assert login(client, "right") == 302
+    assert login(client, "wrong") == 200
+    assert login(client, "right") == 302
+
+
+def test_failures_still_throttle_without_a_success():
+    client = app.app.test_client()
+    assert [login(client, "wrong") for _ in range(5)] == [200] * 5
+    assert login(client, "right") == 429
+
+
+def test_failure_table_is_capped(monkeypatch):
+    monkeypatch.setattr(app, "LOGIN_FAILURE_KEYS_MAX", 3)
+    for name in ("a", "b", "c", "d", "e"):
+        app.record_login_failure(("1.2.3.4", name))
+    assert list(app._login_failures) == [("1.2.3.4", "c"), ("1.2.3.4", "d"), ("1.2.3.4", "e")]
+    app.record_login_failure(("1.2.3.4", "e"))
+    assert app._login_failures[("1.2.3.4", "e")][0] == 2
@@ -0,0 +1,23 @@
+import app
+
+
+def test_parse_professor_ids_drops_non_ascii_digits():
+    assert app.parse_professor_ids(["3", "²", "١", "", "x1", "12"]) == [3, 12]
+
+
+def test_create_unit_ignores_non_ascii_digit(monkeypatch):
+    saved = {}
+
+    def fake_save(table_name, owner_id, plan_data, shared_professors, **kwargs):
+        saved["shared_professors"] = shared_professors
+        return 1
+
+    monkeypatch.setattr(app, "save_plan_record", fake_save)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session["user"] = {"id": 7, "username": "stud", "role": "student-teacher", "is_guest": False}
+
+    response = client.post("/create-unit", data={"unit_topic": "U", "shared_professors": ["3", "²"]})
+
+    assert response.status_code == 302
+    assert saved["shared_professors"] == [3]